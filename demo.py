@@ -117,12 +117,16 @@ def test_api_endpoints():
         
         base_url = "http://127.0.0.1:8001"
         
+        # One pooled session: reuses the TCP connection across all the
+        # endpoint checks instead of a fresh handshake per request
+        session = requests.Session()
+        
         # Test endpoints
         print(f"\n📍 Testing API endpoints at {base_url}")
         
         # Test health endpoint
         try:
-            response = requests.get(f"{base_url}/health")
+            response = session.get(f"{base_url}/health")
             print(f"✅ Health check: {response.status_code}")
             if response.status_code == 200:
                 print(f"   {response.json()}")
@@ -131,7 +135,7 @@ def test_api_endpoints():
         
         # Test history endpoint
         try:
-            response = requests.get(f"{base_url}/history?limit=5")
+            response = session.get(f"{base_url}/history?limit=5")
             print(f"✅ History endpoint: {response.status_code}")
             if response.status_code == 200:
                 history = response.json()
@@ -143,7 +147,7 @@ def test_api_endpoints():
         
         # Test stats endpoint
         try:
-            response = requests.get(f"{base_url}/stats")
+            response = session.get(f"{base_url}/stats")
             print(f"✅ Stats endpoint: {response.status_code}")
             if response.status_code == 200:
                 stats = response.json()
@@ -155,7 +159,7 @@ def test_api_endpoints():
         # Test chat endpoint
         try:
             chat_data = {"message": "This is a test via API"}
-            response = requests.post(f"{base_url}/chat", json=chat_data)
+            response = session.post(f"{base_url}/chat", json=chat_data)
             print(f"✅ Chat endpoint: {response.status_code}")
             if response.status_code == 200:
                 chat_response = response.json()
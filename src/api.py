@@ -1,12 +1,15 @@
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
-from src.database import get_database
+from src.database import get_database, estimate_tokens
 from src.llm_client import ChatbotWithMemory
 from src.config import env
 from src.rate_limiter import RateLimitError
+import asyncio
+import orjson
+import threading
 import uvicorn
 import logging
 
@@ -20,7 +23,8 @@ app = FastAPI(
     description="API for retrieving chat history from SQLite database",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware for production
@@ -35,6 +39,36 @@ app.add_middleware(
 # Initialize database
 database = get_database()
 
+# One chatbot per model, created lazily and reused across requests so we
+# don't pay client/memory/limiter construction on every /chat call.
+_BOT_CACHE: Dict[str, ChatbotWithMemory] = {}
+_BOT_LOCK = threading.Lock()
+
+# In-flight /chat requests keyed by normalized prompt + model, so
+# simultaneous identical prompts share one LLM call.
+_inflight: Dict[Any, "asyncio.Future"] = {}
+_inflight_lock = asyncio.Lock()
+
+def _flush_bot_logs() -> None:
+    """Flush every cached chatbot's buffered hit-log rows.
+
+    Read endpoints call this before touching the database so cache-hit
+    turns served by /chat are visible to them (read-your-writes).
+    """
+    for bot in list(_BOT_CACHE.values()):
+        bot.flush_pending_logs()
+
+def get_bot(model: Optional[str] = None) -> ChatbotWithMemory:
+    """Get (or lazily create) the shared chatbot for a model name."""
+    key = model or ""
+    bot = _BOT_CACHE.get(key)
+    if bot is None:
+        with _BOT_LOCK:
+            bot = _BOT_CACHE.get(key)
+            if bot is None:
+                bot = _BOT_CACHE[key] = ChatbotWithMemory(model=model)
+    return bot
+
 class ChatHistoryResponse(BaseModel):
     """Response model for chat history entries."""
     id: int
@@ -93,11 +127,37 @@ async def get_chat_history(
         List of chat history entries ordered by timestamp (most recent first)
     """
     try:
-        history = database.get_recent_history(limit)
+        # SQLite access is blocking; run it off the event loop
+        await asyncio.to_thread(_flush_bot_logs)
+        history = await asyncio.to_thread(database.get_recent_history, limit)
         return history
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.get("/history/stream")
+async def stream_chat_history(
+    limit: int = Query(100, ge=1, le=1000, description="Number of entries to stream")
+):
+    """
+    Stream recent chat history as newline-delimited JSON.
+
+    Rows are fetched and serialized incrementally, so large pulls never
+    hold the full result set in memory at once.
+
+    Args:
+        limit: Maximum number of entries to stream (default: 100, max: 1000)
+
+    Returns:
+        NDJSON stream of chat history entries, most recent first
+    """
+    await asyncio.to_thread(_flush_bot_logs)
+
+    def ndjson():
+        for entry in database.iter_recent_history(limit):
+            yield orjson.dumps(entry) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @app.get("/stats", response_model=DatabaseStatsResponse)
 async def get_database_stats():
     """
@@ -107,7 +167,8 @@ async def get_database_stats():
         Database statistics
     """
     try:
-        stats = database.get_stats()
+        await asyncio.to_thread(_flush_bot_logs)
+        stats = await asyncio.to_thread(database.get_stats)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -128,25 +189,51 @@ async def chat_with_bot(request: ChatRequest):
         # Validate input
         if not request.message or not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
-        
-        # Initialize chatbot with specified model or default
-        chatbot = ChatbotWithMemory(model=request.model)
-        
-        # Track cache stats before the request
-        cache_stats_before = chatbot.get_cache_stats()
-        hits_before = cache_stats_before['hits']
-        
-        # Get response from chatbot (automatically logs to database)
-        response = chatbot.chat(request.message.strip())
-        
-        # Check if this was a cache hit
-        cache_stats_after = chatbot.get_cache_stats()
-        hits_after = cache_stats_after['hits']
-        was_cached = hits_after > hits_before
-        
-        # Estimate tokens (this is already calculated in the chat method)
-        from src.database import estimate_tokens
-        total_tokens = estimate_tokens(request.message) + estimate_tokens(response)
+
+        # Reuse the cached chatbot for this model
+        chatbot = get_bot(request.model)
+        message = request.message.strip()
+
+        # Coalesce concurrent identical prompts: if another request is
+        # already computing this answer, await its result instead of
+        # issuing a second paid LLM call.
+        key = (chatbot.cache.normalize(message), chatbot.model_name)
+        async with _inflight_lock:
+            pending = _inflight.get(key)
+            if pending is None:
+                _inflight[key] = asyncio.get_running_loop().create_future()
+
+        if pending is not None:
+            response = await asyncio.shield(pending)
+            was_cached = True
+            # Followers never ran chat(), so estimate locally from the
+            # shared response text
+            total_tokens = estimate_tokens(message) + estimate_tokens(response)
+        else:
+            future = _inflight[key]
+            try:
+                # Get response from chatbot (automatically logs to database)
+                result = await asyncio.to_thread(chatbot.chat_with_result, message)
+                response = result.response
+                future.set_result(response)
+            except BaseException as exc:
+                future.set_exception(exc)
+                # Mark the exception as retrieved: with no followers
+                # awaiting (the common case, e.g. a routine 429), the
+                # future would otherwise log "exception was never
+                # retrieved" when dropped.
+                future.exception()
+                raise
+            finally:
+                async with _inflight_lock:
+                    _inflight.pop(key, None)
+
+            # The outcome comes back with the call itself, so there is no
+            # shared-attribute read to race with other in-flight turns —
+            # and no re-running estimate_tokens on text chat() already
+            # measured.
+            was_cached = result.was_cached
+            total_tokens = result.tokens_used
         
         logger.info(f"Chat request processed: {len(request.message)} chars, {total_tokens} tokens, cached: {was_cached}")
         
@@ -173,7 +260,11 @@ async def clear_chat_history():
         Number of entries deleted
     """
     try:
-        deleted_count = database.clear_history()
+        # Buffered cache-hit rows would be re-inserted on the next flush
+        # and resurrect "deleted" history, so drop them first
+        for bot in list(_BOT_CACHE.values()):
+            bot.discard_pending_logs()
+        deleted_count = await asyncio.to_thread(database.clear_history)
         return {"message": f"Cleared {deleted_count} chat history entries"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -186,7 +277,7 @@ async def health_check():
     """
     try:
         # Test database connection
-        total_entries = database.get_total_entries()
+        total_entries = await asyncio.to_thread(database.get_total_entries)
         
         # Test API key configuration (without making actual API call)
         from src.config import env
@@ -211,13 +302,18 @@ async def health_check():
             }
         )
 
-def run_server(host: str = "127.0.0.1", port: int = 8000, reload: bool = False):
+def run_server(host: str = "127.0.0.1", port: int = 8000, workers: int = 1, reload: bool = False):
     """
     Run the FastAPI server.
     
     Args:
         host: Host to bind to
         port: Port to bind to
+        workers: Number of worker processes (ignored when reload is enabled,
+            since uvicorn's reloader only supports a single worker). Each
+            worker keeps its own in-memory cache, rate limiter, and
+            database stats counters, so /stats reflects the serving
+            worker rather than a cross-process aggregate
         reload: Enable auto-reload for development
     """
     print(f"🚀 Starting Chat History API server...")
@@ -229,6 +325,7 @@ def run_server(host: str = "127.0.0.1", port: int = 8000, reload: bool = False):
         "src.api:app",
         host=host,
         port=port,
+        workers=workers if not reload else 1,
         reload=reload,
         log_level="info"
     )
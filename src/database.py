@@ -1,57 +1,171 @@
 import sqlite3
-import json
+import threading
+import atexit
+import time
+import queue
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Any, Optional
-import os
 from pathlib import Path
+from src.config import env
+
+# Reusing the exact same statement strings lets sqlite3's internal statement
+# cache skip re-parsing the SQL on every call.
+_INSERT_SQL = '''
+    INSERT INTO chat_history (prompt, response, tokens_used, timestamp, model_name, was_cached)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+_HISTORY_SQL = '''
+    SELECT id, prompt, response, tokens_used, timestamp, model_name, was_cached
+    FROM chat_history
+    ORDER BY id DESC
+    LIMIT ?
+'''
+
+# All schema bootstrap — table, indexes, and any future migrations — lives
+# in one script executed once per connection.
+_SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        prompt TEXT NOT NULL,
+        response TEXT NOT NULL,
+        tokens_used INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,
+        model_name TEXT,
+        was_cached INTEGER NOT NULL DEFAULT 0
+    );
+    -- No timestamp index: recency queries ORDER BY id, which walks the
+    -- rowid primary key directly (ids and timestamps are both insert
+    -- ordered), so an index on timestamp would only add write cost.
+    -- Partial index: only the cached rows are indexed, so seeding the
+    -- cached-entries counter at startup stays cheap as history grows.
+    CREATE INDEX IF NOT EXISTS idx_chat_history_cached
+    ON chat_history(was_cached) WHERE was_cached = 1;
+'''
+
+def _format_timestamp(value) -> Optional[str]:
+    """Convert a stored epoch-microsecond timestamp to an ISO-8601 string.
+
+    Legacy rows written before the integer-timestamp schema carry ISO text
+    and are passed through unchanged.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1e6).isoformat()
+    return value
 
 class ChatDatabase:
     """
     SQLite database manager for storing chat turns.
-    
+
     Each chat turn is stored with:
     - id: Primary key (auto-increment)
     - prompt: User's input prompt
     - response: Assistant's response
     - tokens_used: Number of tokens used (estimated)
     - timestamp: When the chat turn occurred
+
+    A single long-lived connection is kept open for the lifetime of the
+    instance (WAL journal mode, relaxed synchronous) instead of re-opening
+    the database file on every call, which avoids per-call open/fsync costs.
     """
-    
-    def __init__(self, db_path: str = "chat_history.db"):
+
+    def __init__(self, db_path: str = "chat_history.db", fast: bool = False):
         """
         Initialize the database connection and create tables if they don't exist.
-        
+
         Args:
             db_path: Path to the SQLite database file
+            fast: Trade all durability for speed (no fsyncs, in-memory
+                journal, exclusive lock). Only for throwaway databases,
+                e.g. test fixtures — a crash loses everything.
         """
-        # Ensure the database directory exists
-        db_file = Path(db_path)
-        db_file.parent.mkdir(parents=True, exist_ok=True)
-        
+        # Ensure the database directory exists (":memory:" needs none)
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
         self.db_path = db_path
+
+        # One persistent connection shared across threads, guarded by a lock.
+        # isolation_level=None puts sqlite3 in autocommit mode so single
+        # statements don't leave transactions open.
+        # DB_SYNCHRONOUS lets deployments trade durability for speed
+        # (FULL = safest, NORMAL = WAL default, OFF = no fsync).
+        synchronous = (env("DB_SYNCHRONOUS", "NORMAL") or "NORMAL").upper()
+        if synchronous not in ("OFF", "NORMAL", "FULL"):
+            synchronous = "NORMAL"
+
+        self._lock = threading.RLock()
+        # Set while an explicit transaction()/savepoint() block is open;
+        # log_chat_turn then writes directly instead of going through the
+        # writer queue.
+        self._in_txn = False
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, cached_statements=256
+        )
+        self._conn.row_factory = sqlite3.Row  # This enables column access by name
+        if fast:
+            self._conn.executescript('''
+                PRAGMA synchronous=OFF;
+                PRAGMA journal_mode=MEMORY;
+                PRAGMA locking_mode=EXCLUSIVE;
+                PRAGMA temp_store=MEMORY;
+            ''')
+        else:
+            self._conn.executescript(f'''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous={synchronous};
+                PRAGMA temp_store=MEMORY;
+                PRAGMA mmap_size=268435456;
+                PRAGMA cache_size=-20000;
+            ''')
+
         self._init_database()
-    
+
+        # Running totals maintained on every insert so get_stats is an
+        # attribute read instead of a table aggregation. Seeded once from
+        # whatever the file already contains.
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(tokens_used), 0)
+                FROM chat_history
+            ''').fetchone()
+            # Counting WHERE was_cached = 1 lets the partial index answer
+            # this without scanning the table
+            cached = self._conn.execute(
+                'SELECT COUNT(*) FROM chat_history WHERE was_cached = 1'
+            ).fetchone()
+            latest = self._conn.execute(
+                'SELECT timestamp FROM chat_history ORDER BY id DESC LIMIT 1'
+            ).fetchone()
+        self._total_entries, self._total_tokens = row
+        self._cached_entries = cached[0]
+        self._latest_ts = latest[0] if latest else None
+        # Inserts since the last PRAGMA optimize run
+        self._inserts_since_optimize = 0
+
+        # Writes are funnelled through a queue drained by a single daemon
+        # thread, so concurrent chat turns are committed in one batched
+        # transaction (one fsync) instead of one transaction per row.
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer_thread.start()
+
+        # The writer is a daemon thread, so flush anything still queued
+        # (and give the planner fresh statistics) before interpreter
+        # shutdown.
+        atexit.register(self.close)
+
     def _init_database(self):
-        """Create the chat_history table if it doesn't exist."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS chat_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    prompt TEXT NOT NULL,
-                    response TEXT NOT NULL,
-                    tokens_used INTEGER NOT NULL,
-                    timestamp DATETIME NOT NULL,
-                    model_name TEXT,
-                    was_cached BOOLEAN DEFAULT FALSE
-                )
-            ''')
-            conn.commit()
-    
+        """Run the schema bootstrap script (table and indexes)."""
+        with self._lock:
+            self._conn.executescript(_SCHEMA_SQL)
+
     def log_chat_turn(
-        self, 
-        prompt: str, 
-        response: str, 
+        self,
+        prompt: str,
+        response: str,
         tokens_used: int,
         model_name: Optional[str] = None,
         was_cached: bool = False,
@@ -59,7 +173,7 @@ class ChatDatabase:
     ) -> int:
         """
         Log a chat turn to the database.
-        
+
         Args:
             prompt: User's input prompt
             response: Assistant's response
@@ -67,102 +181,380 @@ class ChatDatabase:
             model_name: Name of the model used
             was_cached: Whether the response was served from cache
             timestamp: When the chat occurred (defaults to now)
-            
+
         Returns:
             The ID of the inserted record
         """
+        # Store timestamps as integer epoch microseconds: smaller rows,
+        # integer ordering, and no datetime allocation on the insert path.
         if timestamp is None:
-            timestamp = datetime.now()
-        
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO chat_history (prompt, response, tokens_used, timestamp, model_name, was_cached)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (prompt, response, tokens_used, timestamp, model_name, was_cached))
-            conn.commit()
-            return cursor.lastrowid
-    
+            ts_us = time.time_ns() // 1000
+        else:
+            ts_us = int(timestamp.timestamp() * 1e6)
+
+        row = (prompt, response, tokens_used, ts_us, model_name, int(bool(was_cached)))
+
+        if self._in_txn:
+            # Inside an explicit transaction()/savepoint() block: write
+            # directly on the already-open transaction; the single commit
+            # at block exit covers every insert. Counters are updated
+            # eagerly and restored from a snapshot on rollback.
+            with self._lock:
+                cursor = self._conn.execute(_INSERT_SQL, row)
+                self._apply_counter_deltas((row,))
+                return cursor.lastrowid
+
+        future: Future = Future()
+        self._write_queue.put((row, future))
+        # Waiting on the future preserves read-your-writes semantics and the
+        # row-id return value; batching still kicks in when multiple threads
+        # enqueue concurrently.
+        return future.result()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group multiple log_chat_turn calls into one transaction.
+
+        All inserts made inside the block share a single commit (one
+        fsync) and roll back together on error. Nested blocks compose via
+        savepoints. The connection lock is held for the duration of the
+        block, so keep transactions short.
+        """
+        with self._lock:
+            snapshot = (self._total_entries, self._total_tokens,
+                        self._cached_entries, self._latest_ts)
+            if self._in_txn:
+                # Already inside a transaction/savepoint: nest
+                self._conn.execute('SAVEPOINT txn_nested')
+                try:
+                    yield self
+                except Exception:
+                    self._conn.execute('ROLLBACK TO txn_nested')
+                    self._conn.execute('RELEASE txn_nested')
+                    (self._total_entries, self._total_tokens,
+                     self._cached_entries, self._latest_ts) = snapshot
+                    raise
+                self._conn.execute('RELEASE txn_nested')
+                return
+
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._in_txn = True
+            try:
+                yield self
+            except Exception:
+                self._in_txn = False
+                self._conn.execute('ROLLBACK')
+                (self._total_entries, self._total_tokens,
+                 self._cached_entries, self._latest_ts) = snapshot
+                raise
+            self._in_txn = False
+            self._conn.execute('COMMIT')
+
+    @contextmanager
+    def savepoint(self):
+        """
+        Run a block of writes inside a savepoint that is always rolled
+        back on exit.
+
+        Intended for tests: a shared database instance can be reused
+        across tests without re-creating files or schema, with each test
+        leaving no trace. Running counters are snapshot-restored too.
+        """
+        with self._lock:
+            snapshot = (self._total_entries, self._total_tokens,
+                        self._cached_entries, self._latest_ts)
+            self._conn.execute('SAVEPOINT sp_restore')
+            prev_in_txn = self._in_txn
+            self._in_txn = True
+            try:
+                yield self
+            finally:
+                self._in_txn = prev_in_txn
+                self._conn.execute('ROLLBACK TO sp_restore')
+                self._conn.execute('RELEASE sp_restore')
+                (self._total_entries, self._total_tokens,
+                 self._cached_entries, self._latest_ts) = snapshot
+
+    def log_chat_turns_batch(self, rows) -> None:
+        """
+        Insert many chat turns in one transaction.
+
+        One commit (one fsync) covers the whole batch, so this is the
+        entry point for buffered logging paths.
+
+        Args:
+            rows: Iterable of (prompt, response, tokens_used, model_name,
+                was_cached) tuples, optionally with a sixth epoch-µs
+                timestamp element (defaults to now)
+        """
+        now_us = time.time_ns() // 1000
+        prepared = []
+        for row in rows:
+            prompt, response, tokens_used, model_name, was_cached = row[:5]
+            ts_us = row[5] if len(row) > 5 else now_us
+            prepared.append(
+                (prompt, response, tokens_used, ts_us, model_name, int(bool(was_cached)))
+            )
+        if not prepared:
+            return
+
+        with self._lock:
+            if self._in_txn:
+                # Already inside an explicit transaction()/savepoint():
+                # ride the open transaction instead of starting one
+                self._conn.executemany(_INSERT_SQL, prepared)
+                self._apply_counter_deltas(prepared)
+                return
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                self._conn.executemany(_INSERT_SQL, prepared)
+                self._conn.execute('COMMIT')
+                self._apply_counter_deltas(prepared)
+            except Exception:
+                try:
+                    self._conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                raise
+
+    def flush(self, timeout: float = 1.0) -> None:
+        """
+        Wait until the queued writes have been handed to the writer thread.
+
+        Args:
+            timeout: Maximum time to wait in seconds
+        """
+        deadline = time.monotonic() + timeout
+        while not self._write_queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _writer_loop(self):
+        """Drain queued chat turns and commit them in batched transactions."""
+        while True:
+            try:
+                batch = [self._write_queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            # Coalesce everything already queued (up to 50 rows) into one
+            # transaction without adding latency for a lone writer.
+            while len(batch) < 50:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        """Insert a batch of (row, future) pairs inside a single transaction."""
+        rows = [row for row, _ in batch]
+        with self._lock:
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                self._conn.executemany(_INSERT_SQL, rows)
+                self._conn.execute('COMMIT')
+                last_id = self._conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                self._apply_counter_deltas(rows)
+            except Exception as exc:
+                try:
+                    self._conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                for _, future in batch:
+                    future.set_exception(exc)
+                return
+
+        # Rows in one executemany transaction get contiguous ids.
+        first_id = last_id - len(rows) + 1
+        for offset, (_, future) in enumerate(batch):
+            future.set_result(first_id + offset)
+
+    def _apply_counter_deltas(self, rows) -> None:
+        """Fold a committed batch of insert rows into the running totals.
+
+        Caller must hold self._lock. Row layout matches _INSERT_SQL.
+        """
+        self._total_entries += len(rows)
+        for row in rows:
+            self._total_tokens += row[2]
+            self._cached_entries += row[5]
+        self._latest_ts = rows[-1][3]
+
+        # Refresh planner statistics periodically; PRAGMA optimize only
+        # re-analyzes what actually changed, so it stays cheap.
+        self._inserts_since_optimize += len(rows)
+        if self._inserts_since_optimize >= 1000 and not self._in_txn:
+            self._conn.execute('PRAGMA optimize')
+            self._inserts_since_optimize = 0
+
     def get_recent_history(self, limit: int = 20) -> List[Dict[str, Any]]:
         """
         Get the most recent chat history entries.
-        
+
         Args:
             limit: Maximum number of entries to return
-            
+
         Returns:
             List of dictionaries containing chat history
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row  # This enables column access by name
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, prompt, response, tokens_used, timestamp, model_name, was_cached
+        with self._lock:
+            # ORDER BY id is equivalent to ORDER BY timestamp (ids are
+            # monotonically increasing) but walks the primary key instead of
+            # sorting a non-indexed text column.
+            cursor = self._conn.execute(_HISTORY_SQL, (limit,))
+            rows = cursor.fetchall()
+
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            # Format only the rows actually returned (bounded by limit)
+            entry['timestamp'] = _format_timestamp(entry['timestamp'])
+            entries.append(entry)
+        return entries
+
+    def get_recent_history_preview(self, limit: int = 20, width: int = 60) -> List[Dict[str, Any]]:
+        """
+        Get recent history with prompt/response truncated inside SQL.
+
+        Display paths (e.g. the CLI db-history command) only show a short
+        preview of each text field, so substr() in the SELECT avoids
+        shipping full multi-KB blobs to Python just to cut them down.
+
+        Args:
+            limit: Maximum number of entries to return
+            width: Maximum characters of prompt/response to keep
+
+        Returns:
+            List of dictionaries with truncated prompt/response fields
+        """
+        with self._lock:
+            cursor = self._conn.execute('''
+                SELECT id, timestamp,
+                       substr(prompt, 1, ?) AS prompt,
+                       length(prompt) AS prompt_len,
+                       substr(response, 1, ?) AS response,
+                       length(response) AS response_len,
+                       tokens_used, was_cached
                 FROM chat_history
-                ORDER BY timestamp DESC
+                ORDER BY id DESC
                 LIMIT ?
-            ''', (limit,))
-            
+            ''', (width, width, limit))
             rows = cursor.fetchall()
-            return [dict(row) for row in rows]
-    
+
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            entry['timestamp'] = _format_timestamp(entry['timestamp'])
+            if entry.pop('prompt_len') > width:
+                entry['prompt'] += '...'
+            if entry.pop('response_len') > width:
+                entry['response'] += '...'
+            entries.append(entry)
+        return entries
+
+    def iter_recent_history(self, limit: int = 20):
+        """
+        Iterate over the most recent chat history entries lazily.
+
+        Fetches rows in small batches instead of materializing the whole
+        result list, so streaming consumers keep peak memory bounded.
+
+        Args:
+            limit: Maximum number of entries to yield
+
+        Yields:
+            Dictionaries containing chat history, most recent first
+        """
+        with self._lock:
+            cursor = self._conn.execute(_HISTORY_SQL, (limit,))
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(64)
+            if not rows:
+                return
+            for row in rows:
+                entry = dict(row)
+                entry['timestamp'] = _format_timestamp(entry['timestamp'])
+                yield entry
+
     def get_total_entries(self) -> int:
         """Get the total number of chat entries in the database."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM chat_history')
+        with self._lock:
+            cursor = self._conn.execute('SELECT COUNT(*) FROM chat_history')
             return cursor.fetchone()[0]
-    
+
     def get_stats(self) -> Dict[str, Any]:
-        """Get database statistics."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Total entries
-            cursor.execute('SELECT COUNT(*) FROM chat_history')
-            total_entries = cursor.fetchone()[0]
-            
-            # Total tokens used
-            cursor.execute('SELECT SUM(tokens_used) FROM chat_history')
-            total_tokens = cursor.fetchone()[0] or 0
-            
-            # Cache hit rate
-            cursor.execute('SELECT COUNT(*) FROM chat_history WHERE was_cached = TRUE')
-            cached_entries = cursor.fetchone()[0]
-            
-            # Most recent entry
-            cursor.execute('SELECT timestamp FROM chat_history ORDER BY timestamp DESC LIMIT 1')
-            latest_result = cursor.fetchone()
-            latest_timestamp = latest_result[0] if latest_result else None
-            
-            cache_hit_rate = (cached_entries / total_entries * 100) if total_entries > 0 else 0
-            
-            return {
-                'total_entries': total_entries,
-                'total_tokens_used': total_tokens,
-                'cached_entries': cached_entries,
-                'cache_hit_rate': round(cache_hit_rate, 1),
-                'latest_timestamp': latest_timestamp
-            }
-    
+        """Get database statistics.
+
+        Served from in-process running counters seeded once at startup,
+        so the call issues no SQL — but it only sees rows written through
+        this instance. When several processes share one database file
+        (run_server(workers=N), or the CLI and API side by side), each
+        process reports its own view; use get_total_entries for a figure
+        read from the file.
+        """
+        with self._lock:
+            # Every field is maintained incrementally on insert, so this
+            # is a pure attribute read — no SQL at all.
+            total_entries = self._total_entries
+            total_tokens = self._total_tokens
+            cached_entries = self._cached_entries
+            latest_ts = self._latest_ts
+
+        latest_timestamp = _format_timestamp(latest_ts) if latest_ts is not None else None
+
+        cache_hit_rate = (cached_entries / total_entries * 100) if total_entries > 0 else 0
+
+        return {
+            'total_entries': total_entries,
+            'total_tokens_used': total_tokens,
+            'cached_entries': cached_entries,
+            'cache_hit_rate': round(cache_hit_rate, 1),
+            'latest_timestamp': latest_timestamp
+        }
+
     def clear_history(self) -> int:
         """
         Clear all chat history from the database.
-        
+
         Returns:
             Number of rows deleted
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM chat_history')
-            deleted_count = cursor.rowcount
-            conn.commit()
-            return deleted_count
-    
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM chat_history')
+            self._total_entries = 0
+            self._total_tokens = 0
+            self._cached_entries = 0
+            self._latest_ts = None
+            return cursor.rowcount
+
+    def close(self) -> None:
+        """
+        Flush pending writes, refresh planner statistics, and close.
+
+        Safe to call more than once (atexit registers it too).
+        """
+        self.flush()
+        with self._lock:
+            try:
+                # Best-effort: optimize needs the file lock and loses to
+                # another process holding it (e.g. parallel test workers
+                # sharing the default path at shutdown)
+                self._conn.execute('PRAGMA optimize')
+            except sqlite3.Error:
+                pass
+            try:
+                self._conn.close()
+            except sqlite3.ProgrammingError:
+                # Already closed
+                pass
+
     def get_current_timestamp(self) -> str:
         """
         Get current timestamp in ISO format.
-        
+
         Returns:
             Current timestamp as ISO string
         """
@@ -174,10 +566,10 @@ _db_instance = None
 def get_database(db_path: str = "chat_history.db") -> ChatDatabase:
     """
     Get a singleton database instance.
-    
+
     Args:
         db_path: Path to the SQLite database file
-        
+
     Returns:
         ChatDatabase instance
     """
@@ -190,12 +582,28 @@ def estimate_tokens(text: str) -> int:
     """
     Estimate the number of tokens in a text string.
     This is a rough approximation: ~4 characters per token for English text.
-    
+
     Args:
         text: Input text to estimate tokens for
-        
+
     Returns:
         Estimated number of tokens
     """
-    # Rough estimate: 4 characters per token on average
-    return len(text) // 4 + 1
+    # Rough estimate: 4 characters per token on average, rounded up with
+    # a floor of 1; len() is O(1) on str and the shift avoids the
+    # floor-division slow path.
+    return max(1, (len(text) + 3) >> 2)
+
+def estimate_tokens_batch(texts: List[str]) -> List[int]:
+    """
+    Estimate tokens for a batch of texts in one pass.
+
+    Args:
+        texts: Input texts to estimate tokens for
+
+    Returns:
+        List of estimated token counts, one per input text
+    """
+    # Single comprehension keeps per-text overhead to a len() call, which
+    # is what batch consumers (e.g. the background writer) want.
+    return [max(1, (len(text) + 3) >> 2) for text in texts]
@@ -1,16 +1,36 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.schema import HumanMessage, AIMessage
-from typing import Optional
+import functools
+import hashlib
+import time
+import weakref
+from collections import deque
+from langchain_core.messages import HumanMessage, AIMessage
+from typing import NamedTuple, Optional
 from src.config import env
 from src.rate_limiter import get_rate_limiter, RateLimitError
 from src.cache import get_cache
 from src.database import get_database, estimate_tokens
 
+class ChatResult(NamedTuple):
+    """Outcome of a single chat turn, private to the call that made it."""
+    response: str
+    tokens_used: int
+    was_cached: bool
+
+def _flush_hit_rows(database, rows) -> None:
+    """Write buffered cache-hit log rows in one transaction.
+
+    Module-level (taking the database and buffer, not the chatbot) so a
+    weakref.finalize can call it at shutdown without keeping the chatbot
+    alive.
+    """
+    if rows:
+        database.log_chat_turns_batch(rows)
+        rows.clear()
+
 class ChatbotWithMemory:
     """
-    A chatbot class that uses LangChain's ConversationBufferWindowMemory 
-    to remember the last 4 user-assistant turns.
+    A chatbot class that keeps a bounded window of the last 4
+    user-assistant turns as conversation memory.
     
     Includes rate limiting protection (default: 10 requests per minute)
     using token bucket algorithm. Returns 429 error when limit exceeded.
@@ -29,6 +49,11 @@ class ChatbotWithMemory:
         model_name = model or env("GEMINI_MODEL", "gemini-2.5-flash")
         self.model_name = model_name
         
+        # Imported here rather than at module top: the google-genai stack
+        # costs hundreds of ms to import, and CLI/API commands that never
+        # build a chatbot shouldn't pay for it.
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        
         # Initialize the LangChain Gemini model
         self.llm = ChatGoogleGenerativeAI(
             model=model_name,
@@ -36,12 +61,10 @@ class ChatbotWithMemory:
             temperature=0.7
         )
         
-        # Initialize memory to keep last 4 user-assistant turns (k=4)
-        # k=4 means keep last 4 messages, but we want 4 turns (8 messages)
-        self.memory = ConversationBufferWindowMemory(
-            k=8,  # Keep last 8 messages (4 user + 4 assistant)
-            return_messages=True
-        )
+        # Conversation window: 4 turns = 8 messages. deque(maxlen=8)
+        # drops the oldest message in O(1) on append, so no per-turn
+        # slicing or reallocation is needed.
+        self._messages: deque = deque(maxlen=8)
         
         # Initialize rate limiter
         self.rate_limiter = get_rate_limiter(requests_per_minute)
@@ -51,11 +74,47 @@ class ChatbotWithMemory:
         
         # Initialize database for logging
         self.database = get_database()
+
+        # Outcome of the most recent chat turn (token count and whether it
+        # was served from cache). Single-threaded convenience for the CLI;
+        # concurrent callers sharing one chatbot should use the per-call
+        # ChatResult from chat_with_result instead.
+        self.last_tokens_used = 0
+        self.last_was_cached = False
+
+        # Cache-hit turns buffer their log rows here and are written in
+        # one batched transaction, so the hit path never waits on a
+        # per-row insert. The finalizer flushes whatever is still
+        # buffered when the chatbot is collected or the process exits,
+        # so no hit rows are lost on a plain CLI quit.
+        self._hit_log_buf: list = []
+        self._hit_log_finalizer = weakref.finalize(
+            self, _flush_hit_rows, self.database, self._hit_log_buf
+        )
     
-    def chat(self, user_input: str) -> str:
+    def chat(self, user_input: str, stream: bool = False) -> str:
         """
         Send a message and get a response while maintaining conversation memory.
         Includes rate limiting protection, LRU caching with TTL, and database logging.
+
+        See chat_with_result for the turn's token count and cache flag.
+        """
+        return self.chat_with_result(user_input, stream).response
+
+    def chat_with_result(self, user_input: str, stream: bool = False) -> ChatResult:
+        """
+        Send a message and get the turn's full outcome.
+
+        Returns a ChatResult (response, tokens_used, was_cached) that is
+        private to this call — unlike the last_tokens_used /
+        last_was_cached attributes, which concurrent callers sharing one
+        chatbot can interleave.
+
+        When stream=True, a cache miss streams the response chunks to
+        stdout as they arrive (first-token latency instead of
+        full-response latency); the full text is still returned, cached,
+        and logged as usual. Cache hits return immediately without
+        printing.
         
         Cache key is generated from:
         - User input
@@ -65,77 +124,83 @@ class ChatbotWithMemory:
         This ensures identical prompts with same context hit cache first.
         All chat turns are logged to SQLite database.
         """
+        # Hoist the attribute chains used repeatedly below into locals;
+        # LOAD_FAST beats repeated LOAD_ATTR on the per-turn hot path.
+        cache = self.cache
+        model = self.model_name
+        window = self._messages
+
         try:
-            # Get conversation history for context
-            messages = self.memory.chat_memory.messages.copy()
-            
-            # Create context string from conversation history for cache key
-            context_parts = []
-            for msg in messages:
-                if hasattr(msg, 'content'):
-                    role = "user" if msg.__class__.__name__ == "HumanMessage" else "assistant"
-                    context_parts.append(f"{role}:{msg.content}")
-            context = "|".join(context_parts)
+            # Fixed-size digest of the conversation window for the cache key
+            context = self._context_digest()
             
             # Check cache first (before rate limiting to save API quota)
-            cached_response = self.cache.get(user_input, self.model_name, context)
+            cached_response = cache.get(user_input, model, context)
             if cached_response is not None:
                 # Cache hit! Save the conversation turn to memory and return cached response
-                self.memory.chat_memory.add_user_message(user_input)
-                self.memory.chat_memory.add_ai_message(cached_response)
-                
-                # Manually enforce the 4-turn (8 message) limit
-                all_messages = self.memory.chat_memory.messages
-                if len(all_messages) > 8:
-                    self.memory.chat_memory.messages = all_messages[-8:]
+                window.append(HumanMessage(content=user_input))
+                window.append(AIMessage(content=cached_response))
                 
-                # Log to database (cache hit)
+                # Log to database (cache hit) — buffered, flushed in batch
                 total_tokens = estimate_tokens(user_input) + estimate_tokens(cached_response)
-                self.database.log_chat_turn(
-                    prompt=user_input,
-                    response=cached_response,
-                    tokens_used=total_tokens,
-                    model_name=self.model_name,
-                    was_cached=True
-                )
+                self.last_tokens_used = total_tokens
+                self.last_was_cached = True
+                self._hit_log_buf.append((
+                    user_input, cached_response, total_tokens,
+                    model, True, time.time_ns() // 1000
+                ))
+                if len(self._hit_log_buf) >= self._HIT_LOG_CAP:
+                    self._flush_hit_log()
                 
-                return cached_response
+                return ChatResult(cached_response, total_tokens, True)
             
-            # Cache miss - check rate limit before making API call
+            # Cache miss: flush buffered hit rows first so the database
+            # preserves turn order, then check the rate limit before the
+            # API call.
+            self._flush_hit_log()
             self.rate_limiter.check_rate_limit()
             
-            # Add the new human message for API call
+            # Build the message list for the API call only now — the hit
+            # path above never needs it
+            messages = list(window)
             messages.append(HumanMessage(content=user_input))
             
             # Get response from the LLM
-            response = self.llm.invoke(messages)
-            response_content = response.content
+            if stream:
+                # Print chunks as they arrive, accumulate for cache/log
+                chunks = []
+                for chunk in self.llm.stream(messages):
+                    text = chunk.content
+                    if text:
+                        chunks.append(text)
+                        print(text, end='', flush=True)
+                print()
+                response_content = ''.join(chunks)
+            else:
+                response = self.llm.invoke(messages)
+                response_content = response.content
             
             # Cache the response for future identical requests
-            self.cache.put(user_input, response_content, self.model_name, context)
-            
-            # Save the conversation turn to memory using memory's methods
-            self.memory.chat_memory.add_user_message(user_input)
-            self.memory.chat_memory.add_ai_message(response_content)
+            cache.put(user_input, response_content, model, context)
             
-            # Manually enforce the 4-turn (8 message) limit since ConversationBufferWindowMemory
-            # might not work exactly as expected
-            all_messages = self.memory.chat_memory.messages
-            if len(all_messages) > 8:
-                # Keep only the last 8 messages (4 turns)
-                self.memory.chat_memory.messages = all_messages[-8:]
+            # Save the conversation turn to memory (the deque evicts the
+            # oldest messages automatically)
+            window.append(HumanMessage(content=user_input))
+            window.append(AIMessage(content=response_content))
             
             # Log to database (new API call)
             total_tokens = estimate_tokens(user_input) + estimate_tokens(response_content)
+            self.last_tokens_used = total_tokens
+            self.last_was_cached = False
             self.database.log_chat_turn(
                 prompt=user_input,
                 response=response_content,
                 tokens_used=total_tokens,
-                model_name=self.model_name,
+                model_name=model,
                 was_cached=False
             )
             
-            return response_content
+            return ChatResult(response_content, total_tokens, False)
             
         except RateLimitError as e:
             # Re-raise rate limit errors with specific handling
@@ -143,17 +208,54 @@ class ChatbotWithMemory:
         except Exception as e:
             raise RuntimeError(f"Chat failed: {str(e)}")
     
+    # Buffered cache-hit rows are flushed at this size
+    _HIT_LOG_CAP = 256
+
+    def _flush_hit_log(self) -> None:
+        """Write any buffered cache-hit log rows in one transaction."""
+        _flush_hit_rows(self.database, self._hit_log_buf)
+
+    def flush_pending_logs(self) -> None:
+        """
+        Write any buffered cache-hit log rows to the database.
+
+        External readers of the shared database (e.g. the API's history
+        and stats endpoints) call this first so buffered turns are
+        visible to them.
+        """
+        self._flush_hit_log()
+
+    def discard_pending_logs(self) -> None:
+        """Drop buffered cache-hit log rows without writing them."""
+        self._hit_log_buf.clear()
+
+    def _context_digest(self) -> bytes:
+        """
+        Digest of the current conversation window, used in cache keys.
+
+        The window (at most 8 messages, strictly alternating user/assistant)
+        is joined into one NUL-separated buffer and fed to BLAKE2b in a
+        single C-level update, so the per-message Python loop disappears.
+        The raw 16-byte digest is used directly — bytes hash fine as part
+        of the cache key tuple, and skipping hexdigest() halves the key.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(b'\x00'.join(
+            m.content.encode('utf-8', 'replace') for m in self._messages
+        ))
+        return digest.digest()
+
     def get_conversation_history(self) -> list:
         """
         Get the current conversation history.
         """
-        return self.memory.chat_memory.messages
+        return list(self._messages)
     
     def clear_memory(self):
         """
         Clear the conversation memory.
         """
-        self.memory.clear()
+        self._messages.clear()
     
     def get_rate_limit_status(self) -> dict:
         """
@@ -164,6 +266,11 @@ class ChatbotWithMemory:
         """
         return self.rate_limiter.get_status()
     
+    @property
+    def cache_hits(self) -> int:
+        """Running cache-hit count (cheap int read, no stats dict)."""
+        return self.cache.hits
+
     def get_cache_stats(self) -> dict:
         """
         Get current cache statistics.
@@ -186,6 +293,7 @@ class ChatbotWithMemory:
         Returns:
             Dictionary with database statistics
         """
+        self._flush_hit_log()
         return self.database.get_stats()
     
     def get_chat_history_from_db(self, limit: int = 20) -> list:
@@ -198,7 +306,21 @@ class ChatbotWithMemory:
         Returns:
             List of chat history entries
         """
+        self._flush_hit_log()
         return self.database.get_recent_history(limit)
+
+    def get_chat_history_preview(self, limit: int = 20) -> list:
+        """
+        Get recent chat history with display-truncated text fields.
+
+        Args:
+            limit: Number of recent entries to retrieve
+
+        Returns:
+            List of chat history entries with truncated prompt/response
+        """
+        self._flush_hit_log()
+        return self.database.get_recent_history_preview(limit)
     
     def clear_database_history(self) -> int:
         """
@@ -207,12 +329,21 @@ class ChatbotWithMemory:
         Returns:
             Number of entries deleted
         """
+        # Buffered rows would otherwise reappear after the clear
+        self.discard_pending_logs()
         return self.database.clear_history()
 
+@functools.lru_cache(maxsize=4)
+def _bot_for(model: Optional[str]) -> ChatbotWithMemory:
+    """Shared chatbot per model name for the legacy call_llm path."""
+    return ChatbotWithMemory(model)
+
 def call_llm(prompt: str, model: Optional[str] = None, timeout: int = 30) -> str:
     """
     Legacy function for backward compatibility.
-    Creates a new chatbot instance for a single call.
+
+    Reuses one chatbot per model so repeated single-shot calls don't
+    rebuild the LLM client, memory, limiter, cache, and database handle
+    every time.
     """
-    chatbot = ChatbotWithMemory(model)
-    return chatbot.chat(prompt)
+    return _bot_for(model).chat(prompt)
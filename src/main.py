@@ -1,6 +1,7 @@
 from src.llm_client import ChatbotWithMemory
 from src.config import env
 from src.rate_limiter import RateLimitError
+from langchain_core.messages import HumanMessage
 import sys
 
 def show_database_stats(chatbot):
@@ -18,24 +19,26 @@ def show_database_stats(chatbot):
 
 def show_database_history(chatbot, limit=10):
     """Show recent database history."""
-    history = chatbot.get_chat_history_from_db(limit)
+    # Preview entries arrive already truncated by the SQL layer
+    history = chatbot.get_chat_history_preview(limit)
     if not history:
         print("📜 No chat history in database yet.")
         return
     
-    print(f"\n📜 Last {len(history)} Database Entries:")
-    print("-" * 60)
+    # Assemble the whole listing first and emit it with one write —
+    # one syscall instead of six prints per row
+    lines = [f"\n📜 Last {len(history)} Database Entries:\n", "-" * 60 + "\n"]
     for entry in history:
         timestamp = entry['timestamp'][:19]  # Remove microseconds
         cached_marker = "📋" if entry['was_cached'] else "🌐"
-        prompt_preview = entry['prompt'][:50] + "..." if len(entry['prompt']) > 50 else entry['prompt']
-        response_preview = entry['response'][:50] + "..." if len(entry['response']) > 50 else entry['response']
-        print(f"ID {entry['id']} - {timestamp} {cached_marker}")
-        print(f"  👤 {prompt_preview}")
-        print(f"  🤖 {response_preview}")
-        print(f"  📊 {entry['tokens_used']} tokens")
-        print()
-    print("-" * 60)
+        lines.append(
+            f"ID {entry['id']} - {timestamp} {cached_marker}\n"
+            f"  👤 {entry['prompt']}\n"
+            f"  🤖 {entry['response']}\n"
+            f"  📊 {entry['tokens_used']} tokens\n\n"
+        )
+    lines.append("-" * 60 + "\n")
+    sys.stdout.write("".join(lines))
 
 def main():
     """
@@ -103,7 +106,7 @@ def main():
                         print("-" * 40)
                         for i, msg in enumerate(history, 1):
                             if hasattr(msg, 'content'):
-                                role = "👤 You" if msg.__class__.__name__ == "HumanMessage" else "🤖 Assistant"
+                                role = "👤 You" if type(msg) is HumanMessage else "🤖 Assistant"
                                 content = msg.content[:100] + "..." if len(msg.content) > 100 else msg.content
                                 print(f"{i}. {role}: {content}")
                         print("-" * 40)
@@ -170,18 +173,20 @@ def main():
                 # Get response from chatbot
                 print("🤖 Assistant: ", end="", flush=True)
                 
-                # Track cache stats before the request
-                stats_before = chatbot.get_cache_stats()
-                hits_before = stats_before['hits']
+                # Track the cache-hit counter before the request — an
+                # int read, not a full stats dict build
+                hits_before = chatbot.cache_hits
                 
-                response = chatbot.chat(user_input)
+                # Misses stream their chunks to the terminal as they
+                # arrive; only cache hits still need printing here
+                response = chatbot.chat(user_input, stream=True)
                 
                 # Check if this was a cache hit
-                stats_after = chatbot.get_cache_stats()
-                hits_after = stats_after['hits']
+                hits_after = chatbot.cache_hits
                 was_cache_hit = hits_after > hits_before
                 
-                print(response)
+                if was_cache_hit:
+                    print(response)
                 
                 conversation_count += 1
                 
@@ -195,7 +200,7 @@ def main():
                 
                 cache_info = "📋 (cached response)" if was_cache_hit else "🌐 (new API call)"
                 print(f"💭 Memory: {memory_status}")
-                print(f"{cache_info} | Cache: {stats_after['hit_rate']}% hit rate")
+                print(f"{cache_info} | Cache hits: {hits_after}")
                     
             except RateLimitError as e:
                 print(f"\n🚫 {e.message}")
@@ -1,5 +1,6 @@
 import time
-from typing import Optional
+import threading
+from typing import Callable, Optional
 from dataclasses import dataclass
 
 @dataclass
@@ -14,63 +15,94 @@ class TokenBucket:
     Allows bursts up to capacity but maintains average rate over time.
     """
     
-    def __init__(self, capacity: int, refill_rate: float):
+    def __init__(self, capacity: int, refill_rate: float,
+                 time_func: Callable[[], int] = time.monotonic_ns):
         """
         Initialize token bucket.
         
         Args:
             capacity: Maximum number of tokens (requests) the bucket can hold
             refill_rate: Number of tokens added per second
+            time_func: Nanosecond clock source; injectable so tests can
+                advance time virtually instead of sleeping
         """
         self.capacity = capacity
-        self.tokens = capacity
         self.refill_rate = refill_rate
-        self.last_refill = time.time()
-    
-    def _refill(self):
-        """Refill tokens based on elapsed time."""
-        now = time.time()
-        elapsed = now - self.last_refill
-        
-        # Add tokens based on elapsed time and refill rate
-        tokens_to_add = elapsed * self.refill_rate
-        self.tokens = min(self.capacity, self.tokens + tokens_to_add)
-        self.last_refill = now
-    
+        # Fixed-point accounting: tokens in integer micro-tokens, refill
+        # rate in micro-tokens per second. Integer math never accumulates
+        # the float rounding drift that slowly under-fills the bucket
+        # over long uptimes.
+        self._capacity_micro = capacity * 1_000_000
+        self._tokens_micro = self._capacity_micro
+        self._rate_micro_per_s = round(refill_rate * 1_000_000)
+        # Monotonic clock: immune to NTP/wall-clock jumps that would
+        # otherwise corrupt the token accounting.
+        self._time_func = time_func
+        self.last_refill_ns = time_func()
+        # Guards the refill/consume read-modify-write so concurrent API
+        # requests can't both spend the same tokens.
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self) -> float:
+        """Current token count (fractional, derived from fixed-point state)."""
+        return self._tokens_micro / 1_000_000
+
+    def _refill(self, now_ns: Optional[int] = None):
+        """Refill tokens based on elapsed time.
+
+        Args:
+            now_ns: Current monotonic time in ns, if the caller already fetched it
+        """
+        if now_ns is None:
+            now_ns = self._time_func()
+        elapsed_ns = now_ns - self.last_refill_ns
+
+        # micro-tokens accrued = elapsed_ns * (micro-tokens/s) / (ns/s)
+        delta_micro = elapsed_ns * self._rate_micro_per_s // 1_000_000_000
+        if delta_micro > 0:
+            self._tokens_micro = min(self._capacity_micro, self._tokens_micro + delta_micro)
+            self.last_refill_ns = now_ns
+
     def consume(self, tokens: int = 1) -> bool:
         """
         Try to consume tokens from the bucket.
-        
+
         Args:
             tokens: Number of tokens to consume
-            
+
         Returns:
             True if tokens were consumed, False if not enough tokens available
         """
-        self._refill()
-        
-        if self.tokens >= tokens:
-            self.tokens -= tokens
-            return True
-        return False
-    
+        cost_micro = tokens * 1_000_000
+        with self._lock:
+            self._refill(self._time_func())
+
+            # Branchless accept/reject: the balance only moves when the
+            # bucket can cover the cost (cost * False == 0).
+            ok = self._tokens_micro >= cost_micro
+            self._tokens_micro -= cost_micro * ok
+            return ok
+
     def time_until_available(self, tokens: int = 1) -> float:
         """
         Calculate time until enough tokens will be available.
-        
+
+        Assumes the bucket was just refilled (consume and get_status both
+        refill first), so no extra clock reading is needed here.
+
         Args:
             tokens: Number of tokens needed
-            
+
         Returns:
             Time in seconds until tokens will be available
         """
-        self._refill()
-        
-        if self.tokens >= tokens:
-            return 0.0
-        
-        tokens_needed = tokens - self.tokens
-        return tokens_needed / self.refill_rate
+        cost_micro = tokens * 1_000_000
+        with self._lock:
+            if self._tokens_micro >= cost_micro:
+                return 0.0
+
+            return (cost_micro - self._tokens_micro) / self._rate_micro_per_s
 
 class RateLimiter:
     """
@@ -92,6 +124,16 @@ class RateLimiter:
         
         # Allow burst of all requests, but maintain average rate
         self.bucket = TokenBucket(capacity=requests_per_minute, refill_rate=refill_rate)
+
+        # Reused by get_status: the constant fields are filled once and
+        # only the two volatile ones are rewritten per call.
+        self._status = {
+            "requests_per_minute": requests_per_minute,
+            "available_tokens": requests_per_minute,
+            "capacity": self.bucket.capacity,
+            "refill_rate_per_second": self.bucket.refill_rate,
+            "time_until_next_token": 0.0,
+        }
     
     def check_rate_limit(self) -> None:
         """
@@ -108,22 +150,39 @@ class RateLimiter:
                 429
             )
     
+    def snapshot_tokens(self) -> int:
+        """
+        Current whole-token count, for hot paths that only need the number.
+
+        Unlike get_status this allocates nothing and does a single locked
+        refill-and-read.
+
+        Returns:
+            Number of whole tokens currently available
+        """
+        bucket = self.bucket
+        with bucket._lock:
+            bucket._refill()
+            return bucket._tokens_micro // 1_000_000
+
     def get_status(self) -> dict:
         """
-        Get current rate limit status.
+        Get current rate limit status (CLI-facing).
         
         Returns:
             Dictionary with current status information
         """
-        self.bucket._refill()  # Update tokens first
-        
-        return {
-            "requests_per_minute": self.requests_per_minute,
-            "available_tokens": int(self.bucket.tokens),
-            "capacity": self.bucket.capacity,
-            "refill_rate_per_second": self.bucket.refill_rate,
-            "time_until_next_token": self.bucket.time_until_available(1)
-        }
+        bucket = self.bucket
+        with bucket._lock:
+            bucket._refill()
+            tokens_micro = bucket._tokens_micro
+            wait = 0.0 if tokens_micro >= 1_000_000 else (
+                (1_000_000 - tokens_micro) / bucket._rate_micro_per_s
+            )
+
+        self._status["available_tokens"] = tokens_micro // 1_000_000
+        self._status["time_until_next_token"] = wait
+        return self._status
 
 # Global rate limiter instance (in-memory)
 # This will be shared across all requests in the same process
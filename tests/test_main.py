@@ -1,95 +1,112 @@
 import os
-import time
+import types
 import pytest
-import tempfile
-import shutil
 from pathlib import Path
+from langchain_core.messages import HumanMessage
 from src.llm_client import call_llm, ChatbotWithMemory
-from src.rate_limiter import RateLimitError, TokenBucket, RateLimiter, reset_rate_limiter
+from src.rate_limiter import RateLimitError, TokenBucket, RateLimiter
 from src.database import ChatDatabase, get_database, estimate_tokens
+from src.cache import LRUCacheWithTTL
 
 # Database tests (no API key required)
-def test_database_initialization():
+@pytest.fixture(scope="session")
+def _shared_db():
+    """One in-memory ChatDatabase for the whole session — schema created
+    once, no file I/O or fsyncs at all. On-disk behaviour is covered by
+    test_database_initialization."""
+    return ChatDatabase(":memory:")
+
+@pytest.fixture(autouse=True)
+def _fresh_rate_limiter(monkeypatch):
+    """Give every test a clean global rate limiter."""
+    from src import rate_limiter
+    monkeypatch.setattr(rate_limiter, "_global_rate_limiter", None)
+
+@pytest.fixture(autouse=True)
+def _isolated_default_db(monkeypatch, _shared_db):
+    """Point the default-path database singleton at the shared in-memory
+    instance, so chatbots built in tests never write (or fsync) the
+    checked-in chat_history.db."""
+    from src import database
+    monkeypatch.setattr(database, "_db_instance", _shared_db)
+
+@pytest.fixture
+def db(_shared_db):
+    """Shared database wrapped in a savepoint rolled back after each test."""
+    with _shared_db.savepoint():
+        yield _shared_db
+
+def test_database_initialization(tmp_path):
     """Test database initialization and table creation."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        db_path = os.path.join(temp_dir, "test.db")
-        db = ChatDatabase(db_path)
-        
-        # Should create the database file
-        assert os.path.exists(db_path)
-        
-        # Should be able to get stats (should be empty initially)
-        stats = db.get_stats()
-        assert stats['total_entries'] == 0
-        assert stats['total_tokens_used'] == 0
+    db_path = tmp_path / "test.db"
+    db = ChatDatabase(str(db_path))
+    
+    # Should create the database file
+    assert db_path.exists()
+    
+    # Should be able to get stats (should be empty initially)
+    stats = db.get_stats()
+    assert stats['total_entries'] == 0
+    assert stats['total_tokens_used'] == 0
+    
+    # Connection should come up in WAL mode with relaxed synchronous
+    # (single fsync per commit instead of two)
+    assert db._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db._conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
 
-def test_database_logging():
+def test_database_logging(db):
     """Test logging chat turns to database."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        db_path = os.path.join(temp_dir, "test.db")
-        db = ChatDatabase(db_path)
-        
-        # Log a chat turn
-        chat_id = db.log_chat_turn(
-            prompt="Hello",
-            response="Hi there!",
-            tokens_used=10,
-            model_name="test-model",
-            was_cached=False
-        )
-        
-        assert chat_id > 0
-        
-        # Check stats
-        stats = db.get_stats()
-        assert stats['total_entries'] == 1
-        assert stats['total_tokens_used'] == 10
-        assert stats['cached_entries'] == 0
+    # Log a chat turn
+    chat_id = db.log_chat_turn(
+        prompt="Hello",
+        response="Hi there!",
+        tokens_used=10,
+        model_name="test-model",
+        was_cached=False
+    )
+    
+    assert chat_id > 0
+    
+    # Check stats
+    stats = db.get_stats()
+    assert stats['total_entries'] == 1
+    assert stats['total_tokens_used'] == 10
+    assert stats['cached_entries'] == 0
 
-def test_database_history_retrieval():
+def test_database_history_retrieval(db):
     """Test retrieving chat history from database."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        db_path = os.path.join(temp_dir, "test.db")
-        db = ChatDatabase(db_path)
-        
-        # Log multiple chat turns
-        for i in range(5):
-            db.log_chat_turn(
-                prompt=f"Question {i}",
-                response=f"Answer {i}",
-                tokens_used=10 + i,
-                was_cached=(i % 2 == 0)
-            )
-        
-        # Get recent history
-        history = db.get_recent_history(limit=3)
-        assert len(history) == 3
-        
-        # Should be in reverse chronological order (most recent first)
-        assert history[0]['prompt'] == "Question 4"
-        assert history[1]['prompt'] == "Question 3"
-        assert history[2]['prompt'] == "Question 2"
-        
-        # Check cache information
-        assert history[0]['was_cached'] == True  # Question 4 (4 % 2 == 0)
-        assert history[1]['was_cached'] == False  # Question 3 (3 % 2 != 0)
+    # Seed all turns with one executemany inside one transaction
+    db.log_chat_turns_batch([
+        (f"Question {i}", f"Answer {i}", 10 + i, None, i % 2 == 0)
+        for i in range(5)
+    ])
+    
+    # Get recent history
+    history = db.get_recent_history(limit=3)
+    assert len(history) == 3
+    
+    # Should be in reverse chronological order (most recent first)
+    assert history[0]['prompt'] == "Question 4"
+    assert history[1]['prompt'] == "Question 3"
+    assert history[2]['prompt'] == "Question 2"
+    
+    # Check cache information
+    assert history[0]['was_cached'] == True  # Question 4 (4 % 2 == 0)
+    assert history[1]['was_cached'] == False  # Question 3 (3 % 2 != 0)
 
-def test_database_clear_history():
+def test_database_clear_history(db):
     """Test clearing database history."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        db_path = os.path.join(temp_dir, "test.db")
-        db = ChatDatabase(db_path)
-        
-        # Add some entries
-        for i in range(3):
-            db.log_chat_turn(f"Test {i}", f"Response {i}", 10)
-        
-        assert db.get_total_entries() == 3
-        
-        # Clear history
-        deleted_count = db.clear_history()
-        assert deleted_count == 3
-        assert db.get_total_entries() == 0
+    # Seed entries with one executemany inside one transaction
+    db.log_chat_turns_batch([
+        (f"Test {i}", f"Response {i}", 10, None, False) for i in range(3)
+    ])
+    
+    assert db.get_total_entries() == 3
+    
+    # Clear history
+    deleted_count = db.clear_history()
+    assert deleted_count == 3
+    assert db.get_total_entries() == 0
 
 def test_token_estimation():
     """Test token estimation function."""
@@ -107,28 +124,29 @@ def test_token_estimation():
     assert estimated <= expected_range + 5  # Some tolerance
 
 # Rate limiting tests (no API key required)
-def test_token_bucket_basic():
-    """Test basic token bucket functionality."""
-    # Create bucket with 5 tokens, refill rate of 1 token per second
-    bucket = TokenBucket(capacity=5, refill_rate=1.0)
-    
-    # Should be able to consume up to capacity
-    assert bucket.consume(5) == True
-    
-    # Should not be able to consume more
-    assert bucket.consume(1) == False
-
-def test_token_bucket_refill():
-    """Test that tokens refill over time."""
-    bucket = TokenBucket(capacity=2, refill_rate=2.0)  # 2 tokens per second
-    
-    # Consume all tokens
-    assert bucket.consume(2) == True
-    assert bucket.consume(1) == False
-    
-    # Wait and check refill
-    time.sleep(1.1)  # Wait just over 1 second
-    assert bucket.consume(2) == True  # Should have refilled
+@pytest.mark.parametrize("capacity,rate,ops", [
+    # Burst up to capacity, then reject
+    pytest.param(5, 1.0, [("consume", 5, True), ("consume", 1, False)],
+                 id="burst-to-capacity"),
+    # Refill over (virtual) time: drained bucket recovers after ~1.1s
+    pytest.param(2, 2.0, [("consume", 2, True), ("consume", 1, False),
+                          ("advance", 1.1, None), ("consume", 2, True)],
+                 id="refill-over-time"),
+    # Refill never overshoots capacity
+    pytest.param(2, 2.0, [("consume", 2, True), ("advance", 60.0, None),
+                          ("consume", 2, True), ("consume", 1, False)],
+                 id="refill-capped-at-capacity"),
+])
+def test_token_bucket(capacity, rate, ops):
+    """Token bucket consume/refill semantics, driven by a virtual clock."""
+    now = [0]
+    bucket = TokenBucket(capacity=capacity, refill_rate=rate, time_func=lambda: now[0])
+    
+    for op, value, expected in ops:
+        if op == "advance":
+            now[0] += int(value * 1_000_000_000)
+        else:
+            assert bucket.consume(value) == expected
 
 def test_rate_limiter_basic():
     """Test basic rate limiter functionality."""
@@ -159,8 +177,6 @@ def test_rate_limiter_error():
 
 def test_chatbot_rate_limiting():
     """Test that chatbot respects rate limits."""
-    reset_rate_limiter()
-    
     # Create chatbot with very low rate limit for testing
     chatbot = ChatbotWithMemory(requests_per_minute=1)
     
@@ -170,27 +186,20 @@ def test_chatbot_rate_limiting():
         self.rate_limiter.check_rate_limit()
         return "Mock response"
     
-    # Replace chat method temporarily
-    original_method = ChatbotWithMemory.chat
-    ChatbotWithMemory.chat = mock_chat
-    
-    try:
-        # First call should work
-        response1 = chatbot.chat("Test 1")
-        assert response1 == "Mock response"
-        
-        # Second immediate call should fail
-        with pytest.raises(RateLimitError):
-            chatbot.chat("Test 2")
-    
-    finally:
-        # Restore original method
-        ChatbotWithMemory.chat = original_method
+    # Bind the mock to this instance only — the class dict stays
+    # untouched, so no restore step is needed
+    chatbot.chat = types.MethodType(mock_chat, chatbot)
+    
+    # First call should work
+    response1 = chatbot.chat("Test 1")
+    assert response1 == "Mock response"
+    
+    # Second immediate call should fail
+    with pytest.raises(RateLimitError):
+        chatbot.chat("Test 2")
 
 def test_chatbot_rate_limit_status():
     """Test rate limit status functionality."""
-    reset_rate_limiter()
-    
     chatbot = ChatbotWithMemory(requests_per_minute=10)
     status = chatbot.get_rate_limit_status()
     
@@ -200,12 +209,46 @@ def test_chatbot_rate_limit_status():
     assert status['requests_per_minute'] == 10
     assert status['capacity'] == 10
 
+def test_response_cache_roundtrip():
+    """The response cache is a pure in-memory dict lookup: identical
+    (normalized) prompts hit, different prompts miss."""
+    cache = LRUCacheWithTTL(max_size=4, ttl_seconds=60)
+    
+    cache.put("What is 2+2?", "4", model="m")
+    
+    # Exact repeat and trivially rephrased prompts hit the same entry
+    assert cache.get("What is 2+2?", model="m") == "4"
+    assert cache.get("  what is 2+2 ", model="m") == "4"
+    
+    # Different prompt or model misses
+    assert cache.get("What is 3+3?", model="m") is None
+    assert cache.get("What is 2+2?", model="other") is None
+    
+    stats = cache.get_stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+
+def test_conversation_window_is_bounded():
+    """Conversation memory is a deque(maxlen=8): appends evict the oldest
+    message in O(1), no slicing or API calls involved."""
+    chatbot = ChatbotWithMemory(requests_per_minute=1000)
+    
+    for i in range(12):
+        chatbot._messages.append(HumanMessage(content=f"Message {i}"))
+    
+    history = chatbot.get_conversation_history()
+    assert len(history) == 8
+    # Oldest four were evicted
+    assert history[0].content == "Message 4"
+    assert history[-1].content == "Message 11"
+
 # Original tests with API key requirements
 def is_valid_api_key():
     """Check if we have a valid API key (not a test key)."""
     api_key = os.getenv("GEMINI_API_KEY")
     return api_key and api_key != "test_key_for_ci" and len(api_key) > 10
 
+@pytest.mark.integration
 @pytest.mark.skipif(not is_valid_api_key(), reason="No valid GEMINI_API_KEY set")
 def test_llm_response_basic():
     """Test basic LLM response."""
@@ -213,11 +256,10 @@ def test_llm_response_basic():
     assert isinstance(out, str)
     assert len(out.strip()) > 0
 
+@pytest.mark.integration
 @pytest.mark.skipif(not is_valid_api_key(), reason="No valid GEMINI_API_KEY set")
 def test_chatbot_memory():
     """Test that the chatbot remembers conversation context."""
-    reset_rate_limiter()  # Reset for clean test
-    
     chatbot = ChatbotWithMemory()
     
     # First message
@@ -234,95 +276,82 @@ def test_chatbot_memory():
     history = chatbot.get_conversation_history()
     assert len(history) == 4  # 2 user messages + 2 assistant messages
 
+@pytest.mark.integration
 @pytest.mark.skipif(not is_valid_api_key(), reason="No valid GEMINI_API_KEY set")
-def test_chatbot_database_integration():
+def test_chatbot_database_integration(tmp_path):
     """Test that chatbot logs to database correctly."""
-    reset_rate_limiter()
-    
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Use a temporary database for testing
-        original_db_path = "chat_history.db"
-        test_db_path = os.path.join(temp_dir, "test_chat.db")
-        
-        # Create chatbot with rate limiting that won't interfere
-        chatbot = ChatbotWithMemory(requests_per_minute=30)
-        
-        # Override the database to use our test database
-        from src.database import ChatDatabase
-        chatbot.database = ChatDatabase(test_db_path)
-        
-        # Have a conversation
-        response = chatbot.chat("Hello, test message")
-        assert isinstance(response, str)
-        
-        # Check that it was logged to database
-        stats = chatbot.get_database_stats()
-        assert stats['total_entries'] == 1
-        assert stats['total_tokens_used'] > 0
-        
-        # Check history
-        history = chatbot.get_chat_history_from_db(limit=1)
-        assert len(history) == 1
-        assert history[0]['prompt'] == "Hello, test message"
-        assert history[0]['response'] == response
+    # Create chatbot with rate limiting that won't interfere
+    chatbot = ChatbotWithMemory(requests_per_minute=30)
+    
+    # Override the database to use our test database (fast mode:
+    # the directory is throwaway, durability is irrelevant)
+    chatbot.database = ChatDatabase(str(tmp_path / "test_chat.db"), fast=True)
+    
+    # Have a conversation
+    response = chatbot.chat("Hello, test message")
+    assert isinstance(response, str)
+    
+    # Check that it was logged to database
+    stats = chatbot.get_database_stats()
+    assert stats['total_entries'] == 1
+    assert stats['total_tokens_used'] > 0
+    
+    # Check history
+    history = chatbot.get_chat_history_from_db(limit=1)
+    assert len(history) == 1
+    assert history[0]['prompt'] == "Hello, test message"
+    assert history[0]['response'] == response
 
+@pytest.mark.integration
 @pytest.mark.skipif(not is_valid_api_key(), reason="No valid GEMINI_API_KEY set") 
-def test_chatbot_database_cache_tracking():
+def test_chatbot_database_cache_tracking(tmp_path):
     """Test that database correctly tracks cache hits."""
-    reset_rate_limiter()
-    
-    with tempfile.TemporaryDirectory() as temp_dir:
-        test_db_path = os.path.join(temp_dir, "test_cache.db")
-        
-        chatbot = ChatbotWithMemory(requests_per_minute=30)
-        
-        # Override database
-        from src.database import ChatDatabase
-        chatbot.database = ChatDatabase(test_db_path)
-        
-        # First request (should be cache miss)
-        response1 = chatbot.chat("What is 2+2?")
-        
-        # Second identical request (should be cache hit)
-        response2 = chatbot.chat("What is 2+2?")
-        
-        # Check database entries
-        history = chatbot.get_chat_history_from_db(limit=2)
-        assert len(history) == 2
-        
-        # First entry should not be cached, second should be
-        assert history[0]['was_cached'] == True   # Most recent (cache hit)
-        assert history[1]['was_cached'] == False  # First one (cache miss)
-        
-        # Check database stats
-        stats = chatbot.get_database_stats()
-        assert stats['total_entries'] == 2
-        assert stats['cached_entries'] == 1
-        assert stats['cache_hit_rate'] == 50.0
+    chatbot = ChatbotWithMemory(requests_per_minute=30)
+    
+    # Override database (fast mode: throwaway database)
+    chatbot.database = ChatDatabase(str(tmp_path / "test_cache.db"), fast=True)
+    
+    # First request (should be cache miss)
+    response1 = chatbot.chat("What is 2+2?")
+    
+    # Second identical request (should be cache hit)
+    response2 = chatbot.chat("What is 2+2?")
+    
+    # Check database entries
+    history = chatbot.get_chat_history_from_db(limit=2)
+    assert len(history) == 2
+    
+    # First entry should not be cached, second should be
+    assert history[0]['was_cached'] == True   # Most recent (cache hit)
+    assert history[1]['was_cached'] == False  # First one (cache miss)
+    
+    # Check database stats
+    stats = chatbot.get_database_stats()
+    assert stats['total_entries'] == 2
+    assert stats['cached_entries'] == 1
+    assert stats['cache_hit_rate'] == 50.0
 
+@pytest.mark.integration
 @pytest.mark.skipif(not is_valid_api_key(), reason="No valid GEMINI_API_KEY set")
 def test_chatbot_memory_limit():
     """Test that the chatbot only remembers last 4 turns."""
-    reset_rate_limiter()  # Reset for clean test
-    
-    chatbot = ChatbotWithMemory()
+    # Generous limit: this test is about memory semantics, not rate
+    # limiting (covered elsewhere), so no inter-call sleeps are needed
+    chatbot = ChatbotWithMemory(requests_per_minute=1000)
     
     # Have more than 4 conversations
     for i in range(6):
         response = chatbot.chat(f"Message number {i+1}")
         assert isinstance(response, str)
-        # Add small delay to avoid rate limiting during test
-        time.sleep(7)  # 10 req/min = 1 req per 6 seconds, so 7 seconds is safe
     
     # Should only remember last 4 turns (8 messages total)
     history = chatbot.get_conversation_history()
     assert len(history) <= 8  # 4 turns × 2 messages per turn
 
+@pytest.mark.integration
 @pytest.mark.skipif(not is_valid_api_key(), reason="No valid GEMINI_API_KEY set")
 def test_chatbot_clear_memory():
     """Test that clearing memory works."""
-    reset_rate_limiter()  # Reset for clean test
-    
     chatbot = ChatbotWithMemory()
     
     # Have a conversation
@@ -333,11 +362,10 @@ def test_chatbot_clear_memory():
     chatbot.clear_memory()
     assert len(chatbot.get_conversation_history()) == 0
 
+@pytest.mark.integration
 @pytest.mark.skipif(not is_valid_api_key(), reason="No valid GEMINI_API_KEY set")
 def test_chatbot_with_rate_limiting_integration():
     """Integration test for chatbot with rate limiting."""
-    reset_rate_limiter()
-    
     # Create chatbot with low rate limit for testing
     chatbot = ChatbotWithMemory(requests_per_minute=2)
     